@@ -4,21 +4,27 @@ VALIDACIÓN DE DATOS
 import pandas as pd
 import numpy as np
 
+from tipos_datos import DTYPES
+
 def validar_csv(filepath):
     """
     Valida el archivo CSV de entrada
     """
     print("Validando datos")
     
+    columnas_requeridas = ['date', 'ndvi', 'evi', 'lst', 'tmax', 'tmin', 'soil_humidity']
+    
     try:
-        df = pd.read_csv(filepath)
+        # Solo las columnas que se validan (las faltantes se reportan abajo)
+        df = pd.read_csv(filepath, dtype=DTYPES, usecols=lambda c: c in columnas_requeridas)
     except FileNotFoundError:
         print(f"Error: Archivo no encontrado: {filepath}")
         return False
+    except ValueError as e:
+        print(f"Error: Valores no numéricos en el archivo: {e}")
+        return False
     
     # 1. Verificar columnas obligatorias
-    columnas_requeridas = ['date', 'ndvi', 'evi', 'lst', 'tmax', 'tmin', 'soil_humidity']
-    
     faltantes = set(columnas_requeridas) - set(df.columns)
     if faltantes:
         print(f"Eror: Faltan columnas: {faltantes}")
@@ -40,15 +46,19 @@ def validar_csv(filepath):
     
     errores = []
     for col, (min_val, max_val) in validaciones.items():
-        fuera_rango = df[(df[col] < min_val) | (df[col] > max_val)]
-        if len(fuera_rango) > 0:
-            errores.append(f"{col}: {len(fuera_rango)} valores fuera de rango [{min_val}, {max_val}]")
+        # Solo se cuentan los valores, sin crear un DataFrame filtrado
+        arr = df[col].to_numpy()
+        n_fuera = int(np.count_nonzero((arr < min_val) | (arr > max_val)))
+        if n_fuera > 0:
+            errores.append(f"{col}: {n_fuera} valores fuera de rango [{min_val}, {max_val}]")
     
     # 4. Verificar valores nulos
-    nulos = df[columnas_requeridas].isnull().sum()
+    nulos = df[columnas_requeridas].isnull().to_numpy().sum(axis=0)
     if nulos.sum() > 0:
         print("\nValores nulos encontrados:")
-        print(nulos[nulos > 0])
+        for col, n_nulos in zip(columnas_requeridas, nulos):
+            if n_nulos > 0:
+                print(f"{col}: {n_nulos}")
         print("\nSe eliminarán automáticamente en el siguiente paso.")
     
     # 5. Estadísticas básicas
@@ -6,6 +6,22 @@ Genera features adicionales para el modelo de ML
 import pandas as pd
 import numpy as np
 
+from features_numba import rolling_means_prefijo, rolling_max_1d, diff_k, deficit_combinado_1d
+from tipos_datos import DTYPES
+
+# Formato de la columna 'date' en los CSV crudos
+FORMATO_FECHA = '%d/%m/%Y'
+
+# Índice = estres_nivel
+ETIQUETAS_ESTRES = np.array(['sin_estres', 'estres_moderado', 'estres_severo'])
+
+def _a_flotante(serie):
+    """
+    Arreglo para los kernels: conserva float32/float64, los enteros pasan a float64
+    """
+    return serie.to_numpy(dtype=np.result_type(serie.dtype, np.float32))
+
+
 def crear_features(df):
     """
     Crea features derivadas de los datos crudos
@@ -13,90 +29,104 @@ def crear_features(df):
     print("🔧 Creando features...")
     
     # Asegurar que date sea datetime (formato día/mes/año)
-    df['date'] = pd.to_datetime(df['date'], dayfirst=True, format='mixed')
+    # Con el formato exacto pandas usa su parser rápido; cache=True parsea
+    # cada fecha distinta una sola vez
+    try:
+        df['date'] = pd.to_datetime(df['date'], format=FORMATO_FECHA, cache=True)
+    except ValueError:
+        # Archivos con otro formato o fechas mezcladas
+        df['date'] = pd.to_datetime(df['date'], dayfirst=True, format='mixed')
     df = df.sort_values('date').reset_index(drop=True)
     
     # 1. FEATURES TEMPORALES (promedios móviles)
     ventanas = [7, 14]  # 7 y 14 días
     
+    # Arreglos contiguos para los kernels de Numba (una sola extracción)
+    ndvi = _a_flotante(df['ndvi'])
+    humedad = _a_flotante(df['soil_humidity'])
+    lst = _a_flotante(df['lst'])
+    tmax = _a_flotante(df['tmax'])
+    
+    # Las columnas nuevas se juntan aquí y se agregan al final con un solo concat
+    # (asignarlas una por una fragmenta el DataFrame y copia todo en cada paso)
+    nuevas = {}
+    
+    # Promedios móviles de todas las ventanas desde una suma acumulada por columna
+    medias_ndvi = rolling_means_prefijo(ndvi, ventanas)
+    medias_humedad = rolling_means_prefijo(humedad, ventanas)
+    medias_tmax = rolling_means_prefijo(tmax, ventanas)
+    
     for ventana in ventanas:
         # NDVI
-        df[f'ndvi_promedio_{ventana}d'] = df['ndvi'].rolling(window=ventana, min_periods=1).mean()
-        df[f'ndvi_tendencia_{ventana}d'] = df['ndvi'].diff(ventana)
+        nuevas[f'ndvi_promedio_{ventana}d'] = medias_ndvi[ventana]
+        nuevas[f'ndvi_tendencia_{ventana}d'] = diff_k(ndvi, ventana)
         
         # Humedad
-        df[f'humedad_promedio_{ventana}d'] = df['soil_humidity'].rolling(window=ventana, min_periods=1).mean()
-        df[f'humedad_tendencia_{ventana}d'] = df['soil_humidity'].diff(ventana)
+        nuevas[f'humedad_promedio_{ventana}d'] = medias_humedad[ventana]
+        nuevas[f'humedad_tendencia_{ventana}d'] = diff_k(humedad, ventana)
         
         # Temperatura
-        df[f'lst_max_{ventana}d'] = df['lst'].rolling(window=ventana, min_periods=1).max()
-        df[f'tmax_promedio_{ventana}d'] = df['tmax'].rolling(window=ventana, min_periods=1).mean()
+        nuevas[f'lst_max_{ventana}d'] = rolling_max_1d(lst, ventana)
+        nuevas[f'tmax_promedio_{ventana}d'] = medias_tmax[ventana]
     
     # 2. RATIOS E ÍNDICES
-    df['evi_ndvi_ratio'] = df['evi'] / (df['ndvi'] + 0.001)  # Evitar división por 0
-    df['temp_promedio'] = (df['tmax'] + df['tmin']) / 2
-    df['amplitud_termica'] = df['tmax'] - df['tmin']
-    
-    # 3. INDICADOR DE DÉFICIT (combinado)
-    # Normalizar humedad (0-1, donde 0 es malo)
-    humedad_norm = df['soil_humidity'] / 35.0
-    humedad_norm = humedad_norm.clip(0, 1)
-    
-    # Normalizar temperatura (0-1, donde 0 es malo, temperaturas altas)
-    temp_norm = (df['lst'] - 25) / 20
-    temp_norm = temp_norm.clip(0, 1)
-    
-    # Déficit combinado (0-1, donde 1 es peor)
-    df['deficit_combinado'] = (
-        (1 - humedad_norm) * 0.5 +  # 50% peso humedad
-        temp_norm * 0.3 +             # 30% peso temperatura
-        (1 - df['ndvi']) * 0.2        # 20% peso NDVI
-    ).clip(0, 1)
+    nuevas['evi_ndvi_ratio'] = df['evi'] / (df['ndvi'] + 0.001)  # Evitar división por 0
+    nuevas['temp_promedio'] = (df['tmax'] + df['tmin']) / 2
+    nuevas['amplitud_termica'] = df['tmax'] - df['tmin']
+    
+    # 3. INDICADOR DE DÉFICIT (combinado, 0-1 donde 1 es peor)
+    # 50% humedad, 30% temperatura alta, 20% NDVI; un solo recorrido con Numba
+    deficit = np.empty_like(ndvi)
+    deficit_combinado_1d(humedad, lst, ndvi, deficit)
+    nuevas['deficit_combinado'] = deficit
     
     # 4. FEATURES DE FECHA
-    df['mes'] = df['date'].dt.month
-    df['dia_año'] = df['date'].dt.dayofyear
-    df['dias_desde_inicio'] = (df['date'] - df['date'].min()).dt.days
+    nuevas['mes'] = df['date'].dt.month
+    nuevas['dia_año'] = df['date'].dt.dayofyear
+    nuevas['dias_desde_inicio'] = (df['date'] - df['date'].min()).dt.days
     
     # 5. GENERAR ETIQUETAS (TARGET) - Clasificación ajustada a datos reales
     # Basado en percentiles de tus datos para tener distribución equilibrada
     
     # Calcular percentiles para umbrales adaptativos
-    p25_humedad = df['soil_humidity'].quantile(0.25)
-    p50_humedad = df['soil_humidity'].quantile(0.50)
-    p25_ndvi = df['ndvi'].quantile(0.25)
-    p50_ndvi = df['ndvi'].quantile(0.50)
-    p75_lst = df['lst'].quantile(0.75)
+    # (una sola llamada por columna; nanquantile ignora NaN como Series.quantile)
+    p25_humedad, p50_humedad = np.nanquantile(humedad, [0.25, 0.50])
+    p25_ndvi, p50_ndvi = np.nanquantile(ndvi, [0.25, 0.50])
+    p75_lst = np.nanquantile(lst, 0.75)
     
     print(f"\n📊 Umbrales calculados:")
     print(f"   Humedad - P25: {p25_humedad:.1f}, P50: {p50_humedad:.1f}")
     print(f"   NDVI - P25: {p25_ndvi:.2f}, P50: {p50_ndvi:.2f}")
     print(f"   LST - P75: {p75_lst:.1f}")
     
-    df['estres_nivel'] = 0  # Sin estrés por defecto
+    # Arreglos NumPy: las máscaras se combinan sin alinear índices de pandas
+    tendencia_7d = nuevas['ndvi_tendencia_7d']
+    tendencia_14d = nuevas['ndvi_tendencia_14d']
+    
+    humedad_baja = humedad < p50_humedad
     
     # Estrés MODERADO (condiciones intermedias)
-    estres_moderado = (
-        ((df['soil_humidity'] < p50_humedad) & (df['ndvi'] < p50_ndvi)) |
-        ((df['deficit_combinado'] > 0.4) & (df['soil_humidity'] < p50_humedad)) |
-        ((df['ndvi_tendencia_7d'] < -0.03) & (df['soil_humidity'] < p50_humedad))
+    estres_moderado = humedad_baja & (
+        (ndvi < p50_ndvi) |
+        (deficit > 0.4) |
+        (tendencia_7d < -0.03)
     )
-    df.loc[estres_moderado, 'estres_nivel'] = 1
     
     # Estrés SEVERO (condiciones críticas - 25% peor)
     estres_severo = (
-        (df['soil_humidity'] < p25_humedad) |
-        ((df['ndvi'] < p25_ndvi) & (df['soil_humidity'] < p50_humedad)) |
-        ((df['lst'] > p75_lst) & (df['ndvi_tendencia_14d'] < -0.05))
+        (humedad < p25_humedad) |
+        ((ndvi < p25_ndvi) & humedad_baja) |
+        ((lst > p75_lst) & (tendencia_14d < -0.05))
     )
-    df.loc[estres_severo, 'estres_nivel'] = 2
+    
+    # Severo tiene prioridad sobre moderado; sin estrés por defecto
+    nivel = np.select([estres_severo, estres_moderado], [2, 1], default=0).astype(np.int8)
+    nuevas['estres_nivel'] = nivel
     
     # Mapeo a texto
-    df['estres_etiqueta'] = df['estres_nivel'].map({
-        0: 'sin_estres',
-        1: 'estres_moderado',
-        2: 'estres_severo'
-    })
+    nuevas['estres_etiqueta'] = ETIQUETAS_ESTRES[nivel]
+    
+    df = pd.concat([df, pd.DataFrame(nuevas, index=df.index)], axis=1)
     
     return df
 
@@ -106,7 +136,7 @@ def procesar_datos(input_file, output_file):
     Pipeline completo de procesamiento
     """
     print("📂 Cargando datos...")
-    df = pd.read_csv(input_file)
+    df = pd.read_csv(input_file, dtype=DTYPES)
     
     print(f"✅ {len(df)} registros cargados")
     
@@ -3,22 +3,129 @@ ENTRENAMIENTO DE MODELO
 =========================================
 Entrena modelo de clasificación de estrés
 """
+import os
+
+# Antes de importar numpy/sklearn: un hilo BLAS/OpenMP por worker de joblib
+# para no sobre-suscribir los núcleos mientras se entrena el bosque
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+os.environ.setdefault('MKL_NUM_THREADS', '1')
+
+import argparse
 import pandas as pd
 import numpy as np
 import joblib
+import psutil
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-def entrenar_modelo(input_file, output_model):
+from tipos_datos import DTYPES
+
+def exportar_onnx(modelo, n_features, output_onnx):
+    """
+    Exporta el Random Forest a ONNX para servirlo con onnxruntime
+    """
+    # Las APIs prefieren el ONNX: si la exportación falla no debe quedar el de
+    # un entrenamiento anterior junto al pickle nuevo
+    if os.path.exists(output_onnx):
+        os.remove(output_onnx)
+    
+    try:
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+    except ImportError:
+        print("⚠️  skl2onnx no instalado: se omite la exportación a ONNX")
+        return None
+    
+    temporal = output_onnx + '.tmp'
+    try:
+        onx = convert_sklearn(
+            modelo,
+            initial_types=[('X', FloatTensorType([None, n_features]))],
+            options={id(modelo): {'zipmap': False}}  # probabilidades como matriz
+        )
+        with open(temporal, 'wb') as f:
+            f.write(onx.SerializeToString())
+        os.replace(temporal, output_onnx)
+    except Exception as e:
+        print(f"⚠️  No se pudo exportar a ONNX ({e}): las APIs usarán el modelo de sklearn")
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        return None
+    
+    print(f"✅ Modelo ONNX guardado en: {output_onnx}")
+    return output_onnx
+
+
+def podar_bosque(modelo, X_train, y_train, tolerancia=0.002, min_arboles=20):
+    """
+    Conserva solo los primeros k árboles del Random Forest, con k el menor número
+    cuya precisión OOB (fuera de bolsa) queda a `tolerancia` de la del bosque completo
+    """
+    n = len(X_train)
+    y_idx = np.searchsorted(modelo.classes_, np.asarray(y_train))
+    votos = np.zeros((n, len(modelo.classes_)))
+    
+    # Curva de precisión OOB al ir agregando árboles
+    precision_oob = []
+    for arbol, muestras in zip(modelo.estimators_, modelo.estimators_samples_):
+        oob = np.ones(n, dtype=bool)
+        oob[muestras] = False
+        votos[oob] += arbol.predict_proba(X_train[oob], check_input=False)
+        evaluadas = votos.sum(axis=1) > 0
+        precision_oob.append(np.mean(votos[evaluadas].argmax(axis=1) == y_idx[evaluadas]))
+    
+    precision_oob = np.array(precision_oob)
+    k = int(np.argmax(precision_oob >= precision_oob[-1] - tolerancia)) + 1
+    k = min(max(k, min_arboles), len(modelo.estimators_))
+    
+    print(f"🌲 Árboles conservados: {k}/{len(modelo.estimators_)} "
+          f"(OOB {precision_oob[k - 1]:.3f} vs {precision_oob[-1]:.3f})")
+    
+    modelo.estimators_ = modelo.estimators_[:k]
+    modelo.n_estimators = k
+    return modelo
+
+
+def graficar_resultados(cm, importancias, target_names):
+    """
+    Guarda la matriz de confusión y el top 10 de features en outputs/
+    """
+    # Importación diferida: matplotlib/seaborn solo se cargan si se piden gráficos
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    
+    print("\n📊 Generando gráficos...")
+    fig, axes = plt.subplots(1, 2, figsize=(14, 5))
+    
+    # Matriz de confusión
+    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues',
+                xticklabels=target_names, yticklabels=target_names,
+                ax=axes[0])
+    axes[0].set_title('Matriz de Confusión', fontsize=14, fontweight='bold')
+    axes[0].set_ylabel('Valor Real')
+    axes[0].set_xlabel('Predicción')
+    
+    # Top 10 features
+    top10 = importancias.head(10)
+    axes[1].barh(range(len(top10)), top10['importancia'])
+    axes[1].set_yticks(range(len(top10)))
+    axes[1].set_yticklabels(top10['feature'])
+    axes[1].set_xlabel('Importancia')
+    axes[1].set_title('Top 10 Features', fontsize=14, fontweight='bold')
+    axes[1].invert_yaxis()
+    
+    plt.tight_layout()
+    plt.savefig('outputs/resultados_modelo.png', dpi=300, bbox_inches='tight')
+    print("✅ Gráficos guardados en: outputs/resultados_modelo.png")
+
+
+def entrenar_modelo(input_file, output_model, graficar=False):
     """
     Entrena el modelo de clasificación
     """
     print("🌱 Cargando datos procesados...")
-    df = pd.read_csv(input_file)
+    df = pd.read_csv(input_file, dtype=DTYPES)
     
     # Seleccionar features (X)
     features = [
@@ -74,29 +181,34 @@ def entrenar_modelo(input_file, output_model):
     
     print(f"\n   Train: {len(X_train)} | Test: {len(X_test)}")
     
-    # Escalar features
-    print("\n⚙️  Escalando features...")
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    # Sin escalado: los cortes de los árboles no cambian con transformaciones
+    # monótonas por feature, así que StandardScaler no aporta nada al Random Forest.
+    # Se entrena con arreglos float32 (sin nombres de columnas), igual que en las APIs
+    X_train = X_train.to_numpy(dtype=np.float32)
+    X_test = X_test.to_numpy(dtype=np.float32)
     
-    # Entrenar modelo
+    # Entrenar modelo (un worker por núcleo físico: los hermanos SMT
+    # comparten caché y no aceleran la construcción de árboles)
     print("🚀 Entrenando modelo Random Forest...")
+    nucleos = psutil.cpu_count(logical=False) or 1
     modelo = RandomForestClassifier(
         n_estimators=100,
         max_depth=10,
         min_samples_split=10,
         class_weight='balanced',
         random_state=42,
-        n_jobs=-1
+        n_jobs=nucleos
     )
     
-    modelo.fit(X_train_scaled, y_train)
+    modelo.fit(X_train, y_train)
     print("✅ Modelo entrenado")
     
+    # Menos árboles = modelo más chico y predicción más rápida en las APIs
+    modelo = podar_bosque(modelo, X_train, y_train)
+    
     # Evaluar
     print("\n📈 Evaluando modelo...")
-    y_pred = modelo.predict(X_test_scaled)
+    y_pred = modelo.predict(X_test)
     
     accuracy = accuracy_score(y_test, y_pred)
     print(f"\n🎯 Accuracy: {accuracy:.3f}")
@@ -118,35 +230,14 @@ def entrenar_modelo(input_file, output_model):
     print(importancias.head(10).to_string(index=False))
     
     # Visualizar resultados
-    print("\n📊 Generando gráficos...")
-    fig, axes = plt.subplots(1, 2, figsize=(14, 5))
-    
-    # Matriz de confusión
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues',
-                xticklabels=target_names, yticklabels=target_names,
-                ax=axes[0])
-    axes[0].set_title('Matriz de Confusión', fontsize=14, fontweight='bold')
-    axes[0].set_ylabel('Valor Real')
-    axes[0].set_xlabel('Predicción')
-    
-    # Top 10 features
-    top10 = importancias.head(10)
-    axes[1].barh(range(len(top10)), top10['importancia'])
-    axes[1].set_yticks(range(len(top10)))
-    axes[1].set_yticklabels(top10['feature'])
-    axes[1].set_xlabel('Importancia')
-    axes[1].set_title('Top 10 Features', fontsize=14, fontweight='bold')
-    axes[1].invert_yaxis()
-    
-    plt.tight_layout()
-    plt.savefig('outputs/resultados_modelo.png', dpi=300, bbox_inches='tight')
-    print("✅ Gráficos guardados en: outputs/resultados_modelo.png")
+    if graficar:
+        graficar_resultados(cm, importancias, target_names)
     
     # Guardar modelo
     print(f"\n💾 Guardando modelo...")
     modelo_completo = {
         'modelo': modelo,
-        'scaler': scaler,
+        'scaler': None,  # las APIs no escalan cuando es None
         'features': features,
         'importancias': importancias
     }
@@ -154,14 +245,23 @@ def entrenar_modelo(input_file, output_model):
     joblib.dump(modelo_completo, output_model)
     print(f"✅ Modelo guardado en: {output_model}")
     
+    # Predictor compilado para las APIs
+    exportar_onnx(modelo, len(features), os.path.splitext(output_model)[0] + '.onnx')
+    
     return modelo_completo
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrena el modelo de clasificación de estrés")
+    parser.add_argument('--plots', action='store_true',
+                        help="Genera outputs/resultados_modelo.png (matriz de confusión y top features)")
+    args = parser.parse_args()
+    
     # Entrenar modelo
     modelo = entrenar_modelo(
         input_file='data/datos_procesados.csv',
-        output_model='models/modelo.pkl'
+        output_model='models/modelo.pkl',
+        graficar=args.plots
     )
     
     print("\n" + "="*60)
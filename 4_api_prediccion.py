@@ -6,12 +6,25 @@ API para recibir datos y devolver predicciones en tiempo real
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+import os
 import pandas as pd
 import joblib
 import numpy as np
 from datetime import datetime
+from functools import lru_cache
+from contextlib import asynccontextmanager
+from typing import List
 
-app = FastAPI(title="API Predicción de Estrés")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Arranque de cada worker: carga el modelo antes de atender peticiones
+    """
+    cargar_modelo()
+    yield
+
+
+app = FastAPI(title="API Predicción de Estrés", lifespan=lifespan)
 
 # Configurar CORS
 app.add_middleware(
@@ -23,12 +36,69 @@ app.add_middleware(
 )
 
 # Cargar modelo al iniciar
-print("🌱 Cargando modelo...")
-modelo_completo = joblib.load('models/modelo.pkl')
-modelo = modelo_completo['modelo']
-scaler = modelo_completo['scaler']
-features_requeridos = modelo_completo['features']
-print("✅ Modelo cargado")
+# El modelo se carga en el lifespan de cada worker: con workers=N el
+# proceso principal de uvicorn solo supervisa y no necesita su propia copia
+modelo = None
+scaler = None
+features_requeridos = []
+FEATURE_INDEX = {}
+N_FEATURES = 0
+sesion_onnx = None
+
+
+def cargar_modelo():
+    global modelo, scaler, features_requeridos, FEATURE_INDEX, N_FEATURES
+    global scaler_media, scaler_escala, sesion_onnx, entrada_onnx, salida_onnx
+
+    print("🌱 Cargando modelo...")
+    modelo_completo = joblib.load('models/modelo.pkl')
+    modelo = modelo_completo['modelo']
+    # El bosque conserva n_jobs del entrenamiento (núcleos físicos); aquí ya hay
+    # un worker por núcleo, así que cada predicción usa un solo hilo
+    modelo.n_jobs = 1
+    scaler = modelo_completo['scaler']
+    features_requeridos = modelo_completo['features']
+
+    # Posición de cada feature en el vector de entrada del modelo
+    FEATURE_INDEX = {nombre: i for i, nombre in enumerate(features_requeridos)}
+    N_FEATURES = len(features_requeridos)
+
+    # Parámetros del scaler: se aplica en línea, sin la validación de sklearn.
+    # En float32 porque los árboles comparan en float32 y así se evita la copia.
+    # Los modelos entrenados sin escalado guardan scaler=None
+    if scaler is not None:
+        scaler_media = scaler.mean_.astype(np.float32)
+        scaler_escala = scaler.scale_.astype(np.float32)
+    print("✅ Modelo cargado")
+
+    # Predictor compilado con ONNX Runtime (opcional, lo exporta 3_entrenamiento_modelo.py)
+    if os.path.exists('models/modelo.onnx'):
+        try:
+            import onnxruntime as ort
+            # Un hilo por sesión: ya hay un worker por núcleo físico y con los valores
+            # por defecto cada worker abriría un hilo por núcleo
+            opciones = ort.SessionOptions()
+            opciones.intra_op_num_threads = 1
+            opciones.inter_op_num_threads = 1
+            sesion_onnx = ort.InferenceSession('models/modelo.onnx', sess_options=opciones,
+                                               providers=['CPUExecutionProvider'])
+            entrada_onnx = sesion_onnx.get_inputs()[0].name
+            salida_onnx = sesion_onnx.get_outputs()[1].name  # probabilidades
+            print("✅ Predictor ONNX cargado")
+        except ImportError:
+            print("⚠️  onnxruntime no instalado: se usa el modelo de sklearn")
+        except Exception as e:
+            # ONNX corrupto o incompatible: se sigue con el modelo de sklearn
+            sesion_onnx = None
+            print(f"⚠️  No se pudo cargar models/modelo.onnx ({e}): se usa el modelo de sklearn")
+
+
+ETIQUETAS = {0: "sin_estres", 1: "estres_moderado", 2: "estres_severo"}
+NIVELES_ALERTA = {
+    "sin_estres": "✅ ÓPTIMO",
+    "estres_moderado": "⚠️ ALERTA HÍDRICA",
+    "estres_severo": "🚨 CRÍTICO"
+}
 
 
 # Estructura de datos de entrada
@@ -42,6 +112,11 @@ class DatosEntrada(BaseModel):
     soil_humidity: float
 
 
+# Varios registros en una sola petición
+class DatosEntradaBatch(BaseModel):
+    items: List[DatosEntrada]
+
+
 # Estructura de respuesta
 class Prediccion(BaseModel):
     fecha: str
@@ -54,10 +129,25 @@ class Prediccion(BaseModel):
     metricas: dict
 
 
+@lru_cache(maxsize=4096)
+def _parse_fecha(date_str: str) -> tuple:
+    """
+    Devuelve (mes, día del año) de una fecha dd/mm/aaaa, parseada una sola vez
+    """
+    try:
+        fecha = datetime.strptime(date_str, '%d/%m/%Y')
+    except ValueError:
+        # Otros formatos: mismo criterio que antes (pandas con dayfirst)
+        fecha = pd.to_datetime(date_str, dayfirst=True)
+    return fecha.month, fecha.timetuple().tm_yday
+
+
 def calcular_features(datos: DatosEntrada) -> dict:
     """
     Calcula todos los features necesarios para el modelo
     """
+    mes, dia_año = _parse_fecha(datos.date)
+    
     # Features básicos
     features_dict = {
         'ndvi': datos.ndvi,
@@ -80,8 +170,8 @@ def calcular_features(datos: DatosEntrada) -> dict:
         ),
         
         # Features de fecha
-        'mes': pd.to_datetime(datos.date, dayfirst=True).month,
-        'dia_año': pd.to_datetime(datos.date, dayfirst=True).dayofyear,
+        'mes': mes,
+        'dia_año': dia_año,
         'dias_desde_inicio': 0  # No aplica en predicción individual
     }
     
@@ -97,6 +187,32 @@ def calcular_features(datos: DatosEntrada) -> dict:
     return features_dict
 
 
+def llenar_fila(fila: np.ndarray, features_dict: dict) -> None:
+    """
+    Escribe los features en el orden que espera el modelo
+    """
+    for nombre, i in FEATURE_INDEX.items():
+        fila[i] = features_dict[nombre]
+
+
+def escalar(X: np.ndarray) -> np.ndarray:
+    """
+    Aplica el scaler del entrenamiento, si el modelo lo usa
+    """
+    if scaler is None:
+        return X
+    return (X - scaler_media) / scaler_escala
+
+
+def predecir_probabilidades(X_scaled: np.ndarray) -> np.ndarray:
+    """
+    Probabilidades por clase, en el orden de modelo.classes_
+    """
+    if sesion_onnx is None:
+        return modelo.predict_proba(X_scaled)
+    return sesion_onnx.run([salida_onnx], {entrada_onnx: X_scaled})[0]
+
+
 def generar_recomendacion(prediccion: str, probs: dict, datos: DatosEntrada) -> str:
     """
     Genera recomendación basada en la predicción
@@ -122,35 +238,34 @@ def inicio():
     }
 
 
-@app.post("/predecir", response_model=Prediccion)
-def predecir(datos: DatosEntrada):
+def predecir_lote(lote: List[DatosEntrada]) -> List[Prediccion]:
     """
-    Recibe datos actuales y devuelve predicción
+    Predice varios registros con una sola llamada al modelo
     """
-    try:
-        # 1. Calcular features
-        features_dict = calcular_features(datos)
-        
-        # 2. Crear DataFrame con el orden correcto
-        X = pd.DataFrame([features_dict])[features_requeridos]
-        
-        # 3. Escalar
-        X_scaled = scaler.transform(X)
-        
-        # 4. Predecir
-        prediccion_num = modelo.predict(X_scaled)[0]
-        probabilidades = modelo.predict_proba(X_scaled)[0]
-        
+    # 1. Calcular features
+    features_lote = [calcular_features(datos) for datos in lote]
+    
+    # 2. Matriz de entrada con el orden correcto
+    X = np.empty((len(lote), N_FEATURES), dtype=np.float32)
+    for fila, features_dict in zip(X, features_lote):
+        llenar_fila(fila, features_dict)
+    
+    # 3. Escalar
+    X_scaled = escalar(X)
+    
+    # 4. Predecir (clase = mayor probabilidad, igual que modelo.predict)
+    probabilidades_lote = predecir_probabilidades(X_scaled)
+    predicciones_num = modelo.classes_[probabilidades_lote.argmax(axis=1)]
+    
+    respuestas = []
+    for datos, features_dict, prediccion_num, probabilidades in zip(
+        lote, features_lote, predicciones_num, probabilidades_lote
+    ):
         # 5. Mapear predicción
-        mapa = {0: "sin_estres", 1: "estres_moderado", 2: "estres_severo"}
-        prediccion_texto = mapa[prediccion_num]
+        prediccion_texto = ETIQUETAS[prediccion_num]
         
         # 6. Nivel de alerta
-        nivel_alerta = {
-            "sin_estres": "✅ ÓPTIMO",
-            "estres_moderado": "⚠️ ALERTA HÍDRICA",
-            "estres_severo": "🚨 CRÍTICO"
-        }[prediccion_texto]
+        nivel_alerta = NIVELES_ALERTA[prediccion_texto]
         
         # 7. Probabilidades
         probs = {
@@ -173,7 +288,7 @@ def predecir(datos: DatosEntrada):
         }
         
         # 10. Construir respuesta
-        respuesta = Prediccion(
+        respuestas.append(Prediccion(
             fecha=datos.date,
             prediccion=prediccion_texto,
             probabilidad_sin_estres=probs['sin_estres'],
@@ -182,9 +297,33 @@ def predecir(datos: DatosEntrada):
             nivel_alerta=nivel_alerta,
             recomendacion=recomendacion,
             metricas=metricas
-        )
+        ))
+    
+    return respuestas
+
+
+@app.post("/predecir", response_model=Prediccion)
+def predecir(datos: DatosEntrada):
+    """
+    Recibe datos actuales y devuelve predicción
+    """
+    try:
+        return predecir_lote([datos])[0]
         
-        return respuesta
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/predecir_batch", response_model=List[Prediccion])
+def predecir_batch(lote: DatosEntradaBatch):
+    """
+    Recibe varios registros y devuelve una predicción por cada uno
+    """
+    if not lote.items:
+        return []
+    
+    try:
+        return predecir_lote(lote.items)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
@@ -195,7 +334,7 @@ def salud():
     """Verifica que la API esté funcionando"""
     return {
         "estado": "OK",
-        "modelo_cargado": True,
+        "modelo_cargado": modelo is not None,
         "features_requeridos": len(features_requeridos),
         "timestamp": datetime.now().isoformat()
     }
@@ -203,7 +342,19 @@ def salud():
 
 if __name__ == "__main__":
     import uvicorn
-    print("\n🚀 Iniciando API...")
+    import psutil
+    
+    # Un proceso por núcleo físico: la predicción es CPU y un solo event loop
+    # atiende las peticiones en serie. Con varios workers uvicorn necesita la
+    # app como "modulo:app" para importarla en cada proceso
+    workers = psutil.cpu_count(logical=False) or 1
+    print(f"\n🚀 Iniciando API ({workers} workers)...")
     print("📍 Documentación: http://localhost:8000/docs")
     print("📍 Pruebas: http://localhost:8000/docs\n")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(
+        "4_api_prediccion:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=workers,
+        app_dir=os.path.dirname(os.path.abspath(__file__))
+    )
\ No newline at end of file
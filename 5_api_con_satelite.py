@@ -1,14 +1,31 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import pandas as pd
+import os
 import joblib
 import numpy as np
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional
-import requests
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import httpx
 
-app = FastAPI(title="API Predicción con Coordenadas")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Arranque de cada worker: modelo + cliente HTTP
+    cargar_modelo()
+    # Cliente HTTP asíncrono persistente: reutiliza las conexiones TCP/TLS con
+    # NASA POWER sin bloquear el event loop mientras llega la respuesta
+    app.state.http = httpx.AsyncClient(
+        timeout=10,
+        limits=httpx.Limits(max_keepalive_connections=32)
+    )
+    yield
+    await app.state.http.aclose()
+
+app = FastAPI(title="API Predicción con Coordenadas", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,12 +36,60 @@ app.add_middleware(
 )
 
 # Cargar modelo
-print("🌱 Cargando modelo...")
-modelo_completo = joblib.load('models/modelo.pkl')
-modelo = modelo_completo['modelo']
-scaler = modelo_completo['scaler']
-features_requeridos = modelo_completo['features']
-print("✅ Modelo cargado")
+# El modelo se carga en el lifespan de cada worker: con workers=N el
+# proceso principal de uvicorn solo supervisa y no necesita su propia copia
+modelo = None
+scaler = None
+features_requeridos = []
+FEATURE_INDEX = {}
+N_FEATURES = 0
+sesion_onnx = None
+
+def cargar_modelo():
+    global modelo, scaler, features_requeridos, FEATURE_INDEX, N_FEATURES
+    global scaler_media, scaler_escala, sesion_onnx, entrada_onnx, salida_onnx
+
+    print("🌱 Cargando modelo...")
+    modelo_completo = joblib.load('models/modelo.pkl')
+    modelo = modelo_completo['modelo']
+    # El bosque conserva n_jobs del entrenamiento (núcleos físicos); aquí ya hay
+    # un worker por núcleo, así que cada predicción usa un solo hilo
+    modelo.n_jobs = 1
+    scaler = modelo_completo['scaler']
+    features_requeridos = modelo_completo['features']
+
+    # Posición de cada feature en el vector de entrada del modelo
+    FEATURE_INDEX = {nombre: i for i, nombre in enumerate(features_requeridos)}
+    N_FEATURES = len(features_requeridos)
+
+    # Parámetros del scaler: se aplica en línea, sin la validación de sklearn.
+    # En float32 porque los árboles comparan en float32 y así se evita la copia.
+    # Los modelos entrenados sin escalado guardan scaler=None
+    if scaler is not None:
+        scaler_media = scaler.mean_.astype(np.float32)
+        scaler_escala = scaler.scale_.astype(np.float32)
+    print("✅ Modelo cargado")
+
+    # Predictor compilado con ONNX Runtime (opcional, lo exporta 3_entrenamiento_modelo.py)
+    if os.path.exists('models/modelo.onnx'):
+        try:
+            import onnxruntime as ort
+            # Un hilo por sesión: ya hay un worker por núcleo físico y con los valores
+            # por defecto cada worker abriría un hilo por núcleo
+            opciones = ort.SessionOptions()
+            opciones.intra_op_num_threads = 1
+            opciones.inter_op_num_threads = 1
+            sesion_onnx = ort.InferenceSession('models/modelo.onnx', sess_options=opciones,
+                                               providers=['CPUExecutionProvider'])
+            entrada_onnx = sesion_onnx.get_inputs()[0].name
+            salida_onnx = sesion_onnx.get_outputs()[1].name  # probabilidades
+            print("✅ Predictor ONNX cargado")
+        except ImportError:
+            print("⚠️  onnxruntime no instalado: se usa el modelo de sklearn")
+        except Exception as e:
+            # ONNX corrupto o incompatible: se sigue con el modelo de sklearn
+            sesion_onnx = None
+            print(f"⚠️  No se pudo cargar models/modelo.onnx ({e}): se usa el modelo de sklearn")
 
 # Modelos de entrada/salida
 class Coordenadas(BaseModel):
@@ -43,8 +108,21 @@ class Diagnostico(BaseModel):
     tmax: float
     tmin: float
 
-# Función para obtener datos reales desde NASA POWER
-def obtener_datos_satelitales(lat: float, lon: float, fecha: str):
+# Caché LRU de consultas por (lat, lon, fecha); lru_cache no sirve con corrutinas.
+# Guarda tuplas inmutables (tmax, tmin, lst, humedad_relativa)
+CACHE_POWER_MAX = 4096
+cache_power = OrderedDict()
+
+# Valor de relleno de NASA POWER para días que todavía no publica (llega con
+# días de retraso): esas respuestas no se guardan en la caché
+POWER_FILL = -999
+
+async def consultar_nasa_power(lat: float, lon: float, fecha: str):
+    clave = (lat, lon, fecha)
+    if clave in cache_power:
+        cache_power.move_to_end(clave)
+        return cache_power[clave]
+
     fecha_obj = datetime.strptime(fecha, '%Y-%m-%d')
     fecha_inicio = fecha_obj.strftime('%Y%m%d')
     fecha_fin = (fecha_obj + timedelta(days=1)).strftime('%Y%m%d')
@@ -55,7 +133,7 @@ def obtener_datos_satelitales(lat: float, lon: float, fecha: str):
         f"start={fecha_inicio}&end={fecha_fin}&latitude={lat}&longitude={lon}&format=JSON"
     )
 
-    response = requests.get(url)
+    response = await app.state.http.get(url)
     if response.status_code != 200:
         raise Exception("Error al consultar NASA POWER")
 
@@ -64,9 +142,21 @@ def obtener_datos_satelitales(lat: float, lon: float, fecha: str):
 
     tmax = data['properties']['parameter']['T2M_MAX'][dia]
     tmin = data['properties']['parameter']['T2M_MIN'][dia]
-    lst = data['properties']['parameter']['ALLSKY_SFC_LW_DWN'][dia] / 10
+    radiacion = data['properties']['parameter']['ALLSKY_SFC_LW_DWN'][dia]
     humedad_relativa = data['properties']['parameter']['RH2M'][dia]
 
+    resultado = (tmax, tmin, radiacion / 10, humedad_relativa)
+    if POWER_FILL not in (tmax, tmin, radiacion, humedad_relativa):
+        cache_power[clave] = resultado
+        if len(cache_power) > CACHE_POWER_MAX:
+            cache_power.popitem(last=False)
+    return resultado
+
+# Función para obtener datos reales desde NASA POWER
+async def obtener_datos_satelitales(lat: float, lon: float, fecha: str):
+    fecha_obj = datetime.strptime(fecha, '%Y-%m-%d')
+    tmax, tmin, lst, humedad_relativa = await consultar_nasa_power(lat, lon, fecha)
+
     ndvi = max(0.3, min(0.85, 0.6 + (lat % 10) * 0.02 - 0.2))
     evi = max(0.2, min(0.7, ndvi * 0.85))
     soil_humidity = max(5, min(35, humedad_relativa / 3))
@@ -81,8 +171,14 @@ def obtener_datos_satelitales(lat: float, lon: float, fecha: str):
         'soil_humidity': round(soil_humidity, 1)
     }
 
+@lru_cache(maxsize=4096)
+def _parse_fecha(date_str: str) -> tuple:
+    fecha = datetime.strptime(date_str, '%d/%m/%Y')
+    return fecha.month, fecha.timetuple().tm_yday
+
 # Función para calcular features
 def calcular_features(datos):
+    mes, dia_año = _parse_fecha(datos['date'])
     return {
         'ndvi': datos['ndvi'],
         'evi': datos['evi'],
@@ -98,8 +194,8 @@ def calcular_features(datos):
             ((datos['lst'] - 25) / 20) * 0.3 +
             (1 - datos['ndvi']) * 0.2
         ),
-        'mes': datetime.strptime(datos['date'], '%d/%m/%Y').month,
-        'dia_año': datetime.strptime(datos['date'], '%d/%m/%Y').dayofyear,
+        'mes': mes,
+        'dia_año': dia_año,
         'dias_desde_inicio': 0,
         'ndvi_promedio_7d': datos['ndvi'],
         'ndvi_tendencia_7d': 0,
@@ -115,19 +211,36 @@ def calcular_features(datos):
         'tmax_promedio_14d': datos['tmax']
     }
 
+def llenar_fila(fila, features):
+    for nombre, i in FEATURE_INDEX.items():
+        fila[i] = features[nombre]
+
+def escalar(X):
+    if scaler is None:
+        return X
+    return (X - scaler_media) / scaler_escala
+
+def predecir_probabilidades(X_scaled):
+    if sesion_onnx is None:
+        return modelo.predict_proba(X_scaled)
+    return sesion_onnx.run([salida_onnx], {entrada_onnx: X_scaled})[0]
+
 # Endpoint principal
 @app.post("/analizar", response_model=Diagnostico)
-def analizar_campo(coords: Coordenadas):
+async def analizar_campo(coords: Coordenadas):
     try:
         fecha = coords.fecha_fin or datetime.now().strftime('%Y-%m-%d')
-        datos = obtener_datos_satelitales(coords.latitud, coords.longitud, fecha)
+        datos = await obtener_datos_satelitales(coords.latitud, coords.longitud, fecha)
         features = calcular_features(datos)
 
-        X = pd.DataFrame([features])[features_requeridos]
-        X_scaled = scaler.transform(X)
+        X = np.empty((1, N_FEATURES), dtype=np.float32)
+        llenar_fila(X[0], features)
+        X_scaled = escalar(X)
 
-        pred = modelo.predict(X_scaled)[0]
-        prob = modelo.predict_proba(X_scaled)[0][pred]
+        # La predicción es CPU: se ejecuta en el threadpool para no frenar el event loop
+        probabilidades = (await run_in_threadpool(predecir_probabilidades, X_scaled))[0]
+        pred = modelo.classes_[probabilidades.argmax()]
+        prob = float(probabilidades.max())
 
         etiquetas = {0: 'sin_estres', 1: 'estres_moderado', 2: 'estres_severo'}
 
@@ -151,8 +264,16 @@ def inicio():
 
 @app.get("/salud")
 def salud():
-    return {"estado": "OK", "modelo_cargado": True, "timestamp": datetime.now().isoformat()}
+    return {"estado": "OK", "modelo_cargado": modelo is not None, "timestamp": datetime.now().isoformat()}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    import psutil
+    # Un proceso por núcleo físico (la app se pasa como "modulo:app" para multiproceso)
+    uvicorn.run(
+        "5_api_con_satelite:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=psutil.cpu_count(logical=False) or 1,
+        app_dir=os.path.dirname(os.path.abspath(__file__))
+    )
\ No newline at end of file
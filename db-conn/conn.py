@@ -1,6 +1,7 @@
 import os
 import psycopg2
 from psycopg2 import pool
+from contextlib import contextmanager
 from threading import Lock
 from dotenv import load_dotenv
 import os
@@ -37,9 +38,9 @@ class DatabaseConnection:
                  user=None,
                  password=None,
                  host=None,
-                 port=5432,
-                 minconn=1,
-                 maxconn=5):
+                 port=None,
+                 minconn=None,
+                 maxconn=None):
         """
         Initialize the database connection pool if it doesn't already exist.
         """
@@ -50,6 +51,7 @@ class DatabaseConnection:
         host = host or os.getenv('DB_HOST')
         port = port or int(os.getenv('DB_PORT') or 5432)
         minconn = minconn or int(os.getenv('DB_MINCONN') or 1)
+        # Size DB_MAXCONN to (API workers x concurrent requests per worker)
         maxconn = maxconn or int(os.getenv('DB_MAXCONN') or 5)
 
         if not hasattr(self, "_pool"):  # avoid re-initialization
@@ -57,7 +59,9 @@ class DatabaseConnection:
                 if not all([dbname, user, password, host]):
                     raise ValueError("Database configuration incomplete. Please set DB_NAME, DB_USER, DB_PASSWORD and DB_HOST in environment or pass them to DatabaseConnection.")
 
-                self._pool = psycopg2.pool.SimpleConnectionPool(
+                # ThreadedConnectionPool locks getconn/putconn; SimpleConnectionPool
+                # is not safe to share between request threads
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
                     minconn=minconn,
                     maxconn=maxconn,
                     dbname=dbname,
@@ -82,6 +86,15 @@ class DatabaseConnection:
         if self._pool:
             self._pool.putconn(connection)
 
+    @contextmanager
+    def borrow(self):
+        """Borrow a connection for a `with` block; it is always returned to the pool."""
+        connection = self.get_connection()
+        try:
+            yield connection
+        finally:
+            self.release_connection(connection)
+
     def close_all_connections(self):
         """Close all database connections."""
         if self._pool:
@@ -94,12 +107,10 @@ if __name__ == "__main__":
     # Example: create DatabaseConnection using environment variables.
     db = DatabaseConnection()
 
-    conn = db.get_connection()
-    cur = conn.cursor()
-
     try:
-        cur.execute("SELECT version();")
-        print("PostgreSQL version:", cur.fetchone())
+        with db.borrow() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT version();")
+            print("PostgreSQL version:", cur.fetchone())
     finally:
-        db.release_connection(conn)
         db.close_all_connections()
@@ -0,0 +1,100 @@
+"""
+KERNELS NUMBA PARA FEATURES
+===========================
+Ventanas móviles de una sola pasada usadas por crear_features
+"""
+import numpy as np
+from numba import njit, prange
+
+# fastmath sin 'nnan': los kernels dependen de np.isnan, que esa bandera
+# permitiría eliminar
+FASTMATH = {'nsz', 'arcp', 'contract', 'afn'}
+
+
+def rolling_means_prefijo(x, ventanas):
+    """
+    Equivalente a Series.rolling(window=w, min_periods=1).mean() para cada w en
+    `ventanas`, a partir de una sola suma acumulada compartida por todas.
+    Los NaN se ignoran (se cuentan aparte), igual que en pandas
+    """
+    validos = ~np.isnan(x)
+    suma_acum = np.concatenate(([0.0], np.cumsum(np.where(validos, x, 0.0), dtype=np.float64)))
+    cuenta_acum = np.concatenate(([0], np.cumsum(validos)))
+
+    fin = np.arange(1, x.shape[0] + 1)
+    medias = {}
+    for w in ventanas:
+        inicio = np.maximum(fin - w, 0)
+        suma = suma_acum[fin] - suma_acum[inicio]
+        nobs = cuenta_acum[fin] - cuenta_acum[inicio]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            medias[w] = (suma / nobs).astype(x.dtype, copy=False)
+    return medias
+
+
+@njit(cache=True, fastmath=FASTMATH)
+def rolling_max_1d(x, w):
+    """
+    Equivalente a Series.rolling(window=w, min_periods=1).max()
+    Usa una cola monótona de índices (como pandas/_libs/window)
+    """
+    n = x.shape[0]
+    out = np.empty(n, dtype=x.dtype)
+    cola = np.empty(n, dtype=np.int64)
+    inicio = 0
+    fin = 0
+
+    for i in range(n):
+        val = x[i]
+        if not np.isnan(val):
+            while fin > inicio and x[cola[fin - 1]] <= val:
+                fin -= 1
+            cola[fin] = i
+            fin += 1
+        while fin > inicio and cola[inicio] <= i - w:
+            inicio += 1
+        out[i] = x[cola[inicio]] if fin > inicio else np.nan
+
+    return out
+
+
+@njit(cache=True, fastmath=FASTMATH)
+def diff_k(x, k):
+    """
+    Equivalente a Series.diff(k)
+    """
+    n = x.shape[0]
+    out = np.empty(n, dtype=x.dtype)
+    for i in range(n):
+        out[i] = x[i] - x[i - k] if i >= k else np.nan
+    return out
+
+
+@njit(cache=True, fastmath=FASTMATH, parallel=True)
+def deficit_combinado_1d(humedad, lst, ndvi, out):
+    """
+    Déficit combinado (0-1, donde 1 es peor) en una sola pasada, escrito en `out`
+    Los NaN se propagan igual que con Series.clip
+    """
+    for i in prange(humedad.shape[0]):
+        # Normalizar humedad (0-1, donde 0 es malo)
+        h = humedad[i] / 35.0
+        if h > 1.0:
+            h = 1.0
+        elif h < 0.0:
+            h = 0.0
+
+        # Normalizar temperatura (0-1, donde 0 es malo, temperaturas altas)
+        t = (lst[i] - 25.0) / 20.0
+        if t > 1.0:
+            t = 1.0
+        elif t < 0.0:
+            t = 0.0
+
+        # 50% peso humedad, 30% temperatura, 20% NDVI
+        v = (1.0 - h) * 0.5 + t * 0.3 + (1.0 - ndvi[i]) * 0.2
+        if v > 1.0:
+            v = 1.0
+        elif v < 0.0:
+            v = 0.0
+        out[i] = v
@@ -1,22 +1,35 @@
 # -*- coding: utf-8 -*-
 # JAZ + ChatGPT — NDVI (S2), LST (MODIS c/ QC), Tmax/Tmin (ERA5-Land), Lluvia (CHIRPS, interpolada), Humedad (ERA5-Land)
-import ee, pandas as pd, numpy as np, matplotlib.pyplot as plt, time
-from scipy.signal import savgol_filter
+import ee, pandas as pd, numpy as np, matplotlib.pyplot as plt
+import io
+import json
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import pyarrow as pa
+from pyarrow import csv as pacsv
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from joblib import Parallel, delayed
+from numba import njit
 from datetime import datetime
 from pathlib import Path
 import os
 
 # ===================== 0) Inicialización =====================
 PROJECT = "earthengine-jaz"
+# Endpoint de alto volumen: pensado para muchas peticiones getInfo concurrentes
+EE_URL = 'https://earthengine-highvolume.googleapis.com'
 
 def init_ee(project: str):
     try:
-        ee.Initialize(project=project)
+        ee.Initialize(project=project, opt_url=EE_URL)
         print(f"proyecto inicializado: {project}")
     except Exception:
         print("autenticación requerida")
         ee.Authenticate()
-        ee.Initialize(project=project)
+        ee.Initialize(project=project, opt_url=EE_URL)
         print(f"listo: {project}")
 
 init_ee(PROJECT)
@@ -25,8 +38,6 @@ init_ee(PROJECT)
 # Polígono de trabajo (ajústalo si lo necesitas)
 coor = [[
     [-99.68750, 20.32944],
-    [-99.68750, 20.32944],
-    [-99.68417, 20.33250],
     [-99.68417, 20.33250],
     [-99.68444, 20.32889],
     [-99.68750, 20.32944],
@@ -41,36 +52,168 @@ OUT_DIR = r"C:\Users\jaz_v\OneDrive\Documentos\HCKATHON"
 Path(OUT_DIR).mkdir(parents=True, exist_ok=True)
 
 # ===================== 2) Utilidades =====================
-def fc_to_df_batched(fc: ee.FeatureCollection, fields, batch_size=400, pause=0.2) -> pd.DataFrame:
-    """Descarga una FeatureCollection en lotes."""
-    n = int(fc.size().getInfo() or 0)
-    rows = []
-    for i in range(0, n, batch_size):
-        sub = ee.FeatureCollection(fc.toList(batch_size, i)).getInfo()
-        for f in sub.get('features', []):
-            p = f.get('properties', {}) or {}
-            rows.append({k: p.get(k, None) for k in fields})
-        time.sleep(pause)
-    df = pd.DataFrame(rows)
+# Tope global de peticiones HTTP simultáneas a EE (compartido entre hilos)
+EE_SEMAFORO = threading.BoundedSemaphore(25)
+
+def ee_get_info(obj):
+    """getInfo() respetando el tope de peticiones concurrentes."""
+    with EE_SEMAFORO:
+        return obj.getInfo()
+
+def fc_to_df_batched(fc: ee.FeatureCollection, fields, batch_size=400, max_workers=8) -> pd.DataFrame:
+    """Descarga una FeatureCollection en lotes, pidiendo los lotes en paralelo.
+
+    No consulta fc.size() (un viaje más a EE): pide `max_workers` lotes a la vez
+    y se detiene en el primero que llega incompleto, que marca el final.
+    """
+    def pagina(i):
+        return ee_get_info(ee.FeatureCollection(fc.toList(batch_size, i)))
+
+    feats = []
+    inicio = 0
+    fin = False
+    # La concurrencia la limitan el pool y EE_SEMAFORO (ya no hace falta time.sleep)
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        while not fin:
+            offsets = range(inicio, inicio + max_workers * batch_size, batch_size)
+            for sub in ex.map(pagina, offsets):
+                lote = sub.get('features', [])
+                feats.extend(lote)
+                if len(lote) < batch_size:
+                    fin = True
+                    break
+            inicio += max_workers * batch_size
+
+    df = pd.DataFrame.from_records(
+        [f.get('properties') or {} for f in feats], columns=list(fields)
+    )
+    return normalizar_df(df, fields)
+
+def normalizar_df(df: pd.DataFrame, fields) -> pd.DataFrame:
+    """Tipos (fecha + numéricos), descarta filas sin fecha y ordena por fecha.
+
+    Los valores son promedios satelitales ruidosos: float32 sobra en precisión
+    y reduce a la mitad la memoria del resto del flujo.
+    """
     if 'date' in df.columns:
         df['date'] = pd.to_datetime(df['date'], errors='coerce')
-    for col in set(fields) - {'date'}:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+    num_cols = [c for c in fields if c != 'date' and c in df.columns]
+    df[num_cols] = df[num_cols].apply(pd.to_numeric, errors='coerce').astype(np.float32)
     return df.dropna(subset=['date']).sort_values('date').reset_index(drop=True)
 
+# Sesión HTTP compartida por los hilos de descarga: reutiliza las conexiones
+# TLS hacia EE en lugar de abrir una por petición
+HTTP = requests.Session()
+HTTP.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+def descargar_fc(fc: ee.FeatureCollection, fields, batch_size=400) -> pd.DataFrame:
+    """Descarga la FeatureCollection completa como un solo CSV (una respuesta HTTP).
+
+    Si EE rechaza la descarga (p. ej. tabla demasiado grande) se recurre a la
+    paginación con getInfo de fc_to_df_batched.
+    """
+    try:
+        with EE_SEMAFORO:
+            url = fc.getDownloadURL(filetype='csv', selectors=list(fields))
+            r = HTTP.get(url, timeout=300)
+        r.raise_for_status()
+        df = pd.read_csv(io.BytesIO(r.content), usecols=list(fields))
+    except Exception as e:
+        print(f"⚠️ descarga CSV falló ({e}); usando paginación getInfo")
+        return fc_to_df_batched(fc, fields, batch_size=batch_size)
+    return normalizar_df(df, fields)
+
+# Caché local de descargas (Parquet); borra la carpeta para forzar otra descarga
+CACHE_DIR = Path(OUT_DIR) / 'cache'
+
+def con_cache(nombre, consulta, descargar, *args, **kwargs) -> pd.DataFrame:
+    """Devuelve la serie desde CACHE_DIR si ya se descargó con la misma consulta.
+
+    `consulta` debe ser el objeto EE que `descargar` evalúa: la clave es el
+    SHA-256 de su grafo serializado (colección, filtros de fecha, AOI, escala y
+    reductores), así que cualquier cambio en INICIO/FIN/AREA o en el pipeline
+    genera una entrada nueva.
+    """
+    desc = json.dumps({'nombre': nombre, 'ee': consulta.serialize()}, sort_keys=True)
+    clave = hashlib.sha256(desc.encode()).hexdigest()[:16]
+    ruta = CACHE_DIR / f'{nombre}_{clave}.parquet'
+    if ruta.exists():
+        print(f"📦 {nombre}: desde caché ({ruta.name})")
+        return pd.read_parquet(ruta)
+    df = descargar(*args, **kwargs)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(ruta, index=False)
+    return df
+
+@lru_cache(maxsize=None)
+def sg_matriz(ventana, poli):
+    """Matriz (ventana x ventana) del ajuste polinomial por mínimos cuadrados.
+
+    La fila central son los coeficientes de Savitzky-Golay; las demás evalúan el
+    mismo ajuste en cada posición de la ventana, que es lo que hace
+    savgol_filter(mode='interp') en los bordes. Se calcula una vez por (ventana, poli).
+    Solo ventanas impares: con una par scipy centra entre dos muestras.
+    """
+    if ventana % 2 == 0:
+        raise ValueError("la ventana de suavizado debe ser impar")
+    V = np.vander(np.arange(ventana, dtype=np.float64), poli + 1)
+    return V @ np.linalg.pinv(V)
+
+# fastmath sin 'nnan', igual que en features_numba
+@njit(cache=True, fastmath={'nsz', 'arcp', 'contract', 'afn'})
+def sg_aplicar(y, H):
+    """Equivalente a savgol_filter(y, ventana, poli, mode='interp') con H = sg_matriz(...)."""
+    n = y.shape[0]
+    w = H.shape[0]
+    m = w // 2
+    out = np.empty(n, dtype=np.float64)
+    for i in range(n):
+        # Bordes: ventana fija en el extremo; interior: ventana centrada en i
+        if i < m:
+            ini = 0
+        elif i >= n - m:
+            ini = n - w
+        else:
+            ini = i - m
+        fila = i - ini
+        acc = 0.0
+        for j in range(w):
+            acc += H[fila, j] * y[ini + j]
+        out[i] = acc
+    return out
+
 def suavizar_sg(df: pd.DataFrame, ycol='NDVI', ventana=11, poli=3) -> pd.DataFrame:
     y = df[ycol].values.astype(float)
     n = len(y)
     if n < poli + 2:
         return df.assign(ndvisuave=y)
+    # sg_aplicar centra la ventana en una muestra: una ventana par pasa a la impar siguiente
+    if ventana % 2 == 0:
+        ventana += 1
     if ventana > n:
         ventana = n if n % 2 == 1 else n-1
     if ventana < poli + 2:
         ventana = poli + 2 if (poli + 2) % 2 == 1 else poli + 3
-    ysuave = savgol_filter(y, ventana, poli, mode='interp')
+    if ventana > n:
+        raise ValueError("la ventana de suavizado no puede ser mayor que la serie")
+    ysuave = sg_aplicar(y, sg_matriz(ventana, poli))
     return df.assign(ndvisuave=ysuave)
 
+# ---- Geometrías de trabajo ----
+# Proyección a EPSG:4326 y buffers resueltos una sola vez en el servidor (un
+# getInfo); los reduceRegion de cada imagen reciben coordenadas ya calculadas
+# en lugar de repetir transform/buffer. Se mantiene el polígono (no bounds()),
+# así las medias no cambian.
+AREA_PROJ = AREA.transform('EPSG:4326', 1)
+AREA_PROJ, AREA_LST, AREA_PPT, AREA_ERA = (
+    ee.Geometry(g) for g in ee_get_info(ee.List([
+        AREA_PROJ,
+        AREA_PROJ.buffer(600),
+        AREA_PROJ.buffer(1500),
+        AREA_PROJ.buffer(1000),
+    ]))
+)
+
 # ===================== 3) NDVI (Sentinel-2 SR) =====================
 def mask_s2_sr(img):
     qa = img.select('QA60')
@@ -84,34 +227,44 @@ def add_indices(img):
     return img.addBands(ndvi)
 
 s2 = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-      .filterBounds(AREA)
+      .filterBounds(AREA_PROJ)
       .filterDate(INICIO, FIN)
       .filter(ee.Filter.lte('CLOUDY_PIXEL_PERCENTAGE', 50))
       .map(mask_s2_sr)
       .map(add_indices))
 
-def img_to_feature_ndvi(img):
-    ndvi_mean = img.select('NDVI').reduceRegion(
-        ee.Reducer.mean(), AREA, 10, maxPixels=1e13
-    ).get('NDVI')
-    return ee.Feature(None, {
-        'date': ee.Date(img.get('system:time_start')).format('YYYY-MM-dd'),
-        'NDVI': ndvi_mean
+def ndvi_consulta(ic, geom, scale=10) -> ee.Dictionary:
+    """NDVI medio por imagen con un solo reduceRegion sobre ic.toBands().
+
+    Reúne las medias (banda '<system:index>_NDVI'), los índices y las fechas en
+    un solo diccionario, que es lo que se evalúa (y lo que identifica la caché).
+    """
+    medias = ic.select('NDVI').toBands().reduceRegion(
+        ee.Reducer.mean(), geom, scale, maxPixels=1e13
+    )
+    return ee.Dictionary({
+        'ids': ic.aggregate_array('system:index'),
+        't': ic.aggregate_array('system:time_start'),
+        'v': medias,
     })
 
-fc_ndvi = ee.FeatureCollection(s2.map(img_to_feature_ndvi)).filter(ee.Filter.notNull(['NDVI']))
-ndvi_df = fc_to_df_batched(fc_ndvi, fields=('date','NDVI'), batch_size=400, pause=0.2)
-# Diario + suavizado
-ndvi_day = (ndvi_df.groupby('date', as_index=False)['NDVI'].mean()
-            .set_index('date')
-            .resample('D').mean()
-            .interpolate('time')
-            .clip(lower=0, upper=1)
-            .reset_index())
-ndvi_day = suavizar_sg(ndvi_day, 'NDVI', ventana=11, poli=3)
+def ndvi_serie(consulta: ee.Dictionary) -> pd.DataFrame:
+    """Evalúa ndvi_consulta con un único getInfo; la fecha se arma en Python en
+    lugar de un ee.Date.format por imagen."""
+    info = ee_get_info(consulta)
+    df = pd.DataFrame({
+        'date': pd.to_datetime(info['t'], unit='ms').normalize(),
+        'NDVI': [info['v'].get(f'{i}_NDVI') for i in info['ids']],
+    })
+    return normalizar_df(df, ('date','NDVI')).dropna(subset=['NDVI']).reset_index(drop=True)
+
+consulta_ndvi = ndvi_consulta(s2, AREA_PROJ)
 
 # ===================== 4) LST (MODIS con QC — °C) =====================
-AREA_LST = AREA.buffer(600)
+# QC_Day es de 8 bits: los valores aceptables (bits 0-1 = 0 good, 1 average) se
+# calculan una vez en Python y cada imagen solo hace un remap a 1/0
+QC_BUENOS = [v for v in range(256) if v & 3 <= 1]
+QC_UNOS   = [1] * len(QC_BUENOS)
 
 def modis_lst_clean(ic_id, inicio, fin, geom):
     ic = (ee.ImageCollection(ic_id)
@@ -121,7 +274,7 @@ def modis_lst_clean(ic_id, inicio, fin, geom):
     def to_celsius_masked(img):
         lst = img.select('LST_Day_1km')
         qc  = img.select('QC')
-        good_qc = qc.bitwiseAnd(3).lte(1)  # 0 good, 1 average
+        good_qc = qc.remap(QC_BUENOS, QC_UNOS, 0)  # 0 good, 1 average
         valid   = lst.gt(0).And(good_qc)
         lst_c = lst.multiply(0.02).subtract(273.15).updateMask(valid).rename('LST')
         return lst_c.copyProperties(img, ['system:time_start'])
@@ -145,10 +298,8 @@ def img_to_feature_lst(img):
     })
 
 fc_lst = ee.FeatureCollection(lst_all.map(img_to_feature_lst)).filter(ee.Filter.notNull(['LST']))
-lst_df = fc_to_df_batched(fc_lst, fields=('date','LST'), batch_size=300, pause=0.25)
 
 # ===================== 5) Lluvia (CHIRPS, mm/día) + Interpolación =====================
-AREA_PPT = AREA.buffer(1500)
 chirps = (ee.ImageCollection('UCSB-CHG/CHIRPS/DAILY')
           .filterDate(INICIO, FIN)
           .filterBounds(AREA_PPT)
@@ -168,79 +319,19 @@ def img_to_feature_ppt(img):
     })
 
 fc_ppt = ee.FeatureCollection(chirps.map(img_to_feature_ppt)).filter(ee.Filter.notNull(['precip_mm']))
-ppt_df = fc_to_df_batched(fc_ppt, fields=('date','precip_mm'), batch_size=400, pause=0.2)
-
-# ---- Interpolación inteligente de precipitación ----
-# ---- Interpolación inteligente de precipitación ----
-all_days = pd.date_range(start=INICIO, end=FIN, freq='D')
-ppt_full = pd.DataFrame({'date': all_days}).merge(ppt_df, on='date', how='left')
-ppt_full['precip_mm'] = pd.to_numeric(ppt_full['precip_mm'], errors='coerce')
-
-# Detecta rachas de ceros y reemplaza SOLO rachas cortas por NaN para interpolar
-is_zero = ppt_full['precip_mm'].fillna(0).eq(0)
-grp = (is_zero != is_zero.shift()).cumsum()
-run_len = is_zero.groupby(grp).transform('size')
-K = 2  # máximo de días 0 seguidos a tratar como hueco (ajusta 1–3)
-mask_short_zero = is_zero & (run_len <= K)
-ppt_full.loc[mask_short_zero, 'precip_mm'] = np.nan
-
-# >>> clave: usar DatetimeIndex para method='time'
-ppt_full = ppt_full.sort_values('date').set_index('date')
-
-ppt_full['precip_mm_interp'] = (
-    ppt_full['precip_mm']
-    .interpolate(method='time', limit_direction='both')
-    .clip(lower=0)
-)
-
-# Suavizado centrado 3 días (funciona igual con DatetimeIndex)
-ppt_full['precip_mm_roll3'] = (
-    ppt_full['precip_mm_interp'].rolling(3, min_periods=1, center=True).mean()
-)
 
-# Volver a columna 'date' para los merges posteriores
-ppt_full = ppt_full.reset_index()
+# ===================== 6) Humedad de suelo + Tmax/Tmin (ERA5-Land) =====================
+# Ambas variables vienen de la misma colección y área: un solo reduceRegion
+# multibanda por día en lugar de dos pipelines
+era = (ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR')
+       .filterDate(INICIO, FIN)
+       .filterBounds(AREA_ERA)
+       .select(['temperature_2m_max', 'temperature_2m_min', 'volumetric_soil_water_layer_1']))
 
-# Reemplaza ppt_df para el resto del flujo
-ppt_df = ppt_full[['date', 'precip_mm', 'precip_mm_interp', 'precip_mm_roll3']]
-
-
-# ===================== 6) Humedad de suelo (ERA5-Land) =====================
-AREA_SM = AREA.buffer(1000)
-era_sm = (ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR')
-          .filterDate(INICIO, FIN)
-          .filterBounds(AREA_SM)
-          .select('volumetric_soil_water_layer_1'))
-
-def img_to_feature_sm(img):
-    sm = img.reduceRegion(
-        reducer=ee.Reducer.mean(),
-        geometry=AREA_SM,
-        scale=11132,
-        bestEffort=True,
-        maxPixels=1e13
-    ).get('volumetric_soil_water_layer_1')
-    return ee.Feature(None, {
-        'date': ee.Date(img.get('system:time_start')).format('YYYY-MM-dd'),
-        'sm_vwc': sm
-    })
-
-fc_sm = ee.FeatureCollection(era_sm.map(img_to_feature_sm)).filter(ee.Filter.notNull(['sm_vwc']))
-sm_df = fc_to_df_batched(fc_sm, fields=('date','sm_vwc'), batch_size=400, pause=0.2)
-sm_df['sm_pct'] = sm_df['sm_vwc'] * 100.0
-sm_df['water_mm_0_7cm'] = sm_df['sm_vwc'] * 70.0
-
-# ===================== 7) Temperatura aire Tmax/Tmin (ERA5-Land, °C) =====================
-AREA_T2M = AREA.buffer(1000)
-era_t2m = (ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR')
-           .filterDate(INICIO, FIN)
-           .filterBounds(AREA_T2M)
-           .select(['temperature_2m_max', 'temperature_2m_min']))
-
-def img_to_feature_t2m(img):
+def img_to_feature_era(img):
     stats = img.reduceRegion(
         reducer=ee.Reducer.mean(),
-        geometry=AREA_T2M,
+        geometry=AREA_ERA,
         scale=11132,
         bestEffort=True,
         maxPixels=1e13
@@ -250,64 +341,129 @@ def img_to_feature_t2m(img):
     return ee.Feature(None, {
         'date': ee.Date(img.get('system:time_start')).format('YYYY-MM-dd'),
         'tmax_c': tmax_c,
-        'tmin_c': tmin_c
+        'tmin_c': tmin_c,
+        'sm_vwc': stats.get('volumetric_soil_water_layer_1')
     })
 
-fc_t2m = ee.FeatureCollection(era_t2m.map(img_to_feature_t2m)) \
-           .filter(ee.Filter.And(
-               ee.Filter.notNull(['tmax_c']),
-               ee.Filter.notNull(['tmin_c'])
-           ))
-t2m_df = fc_to_df_batched(fc_t2m, fields=('date','tmax_c','tmin_c'), batch_size=400, pause=0.2)
-
-# ===================== 8) Merges =====================
-# Orden temporal
-ndvi_day = ndvi_day.sort_values('date')
-lst_df   = lst_df.sort_values('date')
-ppt_df   = ppt_df.sort_values('date')
-sm_df    = sm_df.sort_values('date')
-t2m_df   = t2m_df.sort_values('date')
-
-# Base: NDVI diario (con ndvisuave)
-master = ndvi_day.copy()  # date, NDVI, ndvisuave
-
-# LST (MODIS 8-días): merge_asof ±4 días
-master = pd.merge_asof(
-    master, lst_df[['date','LST']].dropna(subset=['date']).sort_values('date'),
-    on='date', direction='nearest', tolerance=pd.Timedelta('4D')
-)
+fc_era = ee.FeatureCollection(era.map(img_to_feature_era)) \
+           .filter(ee.Filter.notNull(['tmax_c', 'tmin_c', 'sm_vwc']))
+
+# ===================== 7) Descarga en paralelo =====================
+# Las FeatureCollections de arriba son grafos diferidos (sin getInfo); cada una se
+# baja como un CSV en una sola respuesta HTTP (NDVI con un solo getInfo) y las
+# cuatro se solapan en hilos.
+# EE_SEMAFORO limita el total de peticiones simultáneas. Si la misma consulta ya
+# se descargó antes, con_cache la lee de CACHE_DIR sin tocar EE.
+with ThreadPoolExecutor(max_workers=4) as executor:
+    fut_ndvi = executor.submit(con_cache, 'ndvi', consulta_ndvi,
+                               ndvi_serie, consulta_ndvi)
+    fut_lst  = executor.submit(con_cache, 'lst', fc_lst,
+                               descargar_fc, fc_lst, ('date','LST'), batch_size=300)
+    fut_ppt  = executor.submit(con_cache, 'ppt', fc_ppt,
+                               descargar_fc, fc_ppt, ('date','precip_mm'), batch_size=400)
+    fut_era  = executor.submit(con_cache, 'era', fc_era,
+                               descargar_fc, fc_era, ('date','tmax_c','tmin_c','sm_vwc'), batch_size=400)
+    ndvi_df = fut_ndvi.result()
+    lst_df  = fut_lst.result()
+    ppt_df  = fut_ppt.result()
+    era_df  = fut_era.result()
+
+# ===================== 8) Post-proceso =====================
+# Cada serie se procesa de forma independiente hasta la unión por fecha, así que
+# las cuatro funciones corren en hilos (pandas/NumPy liberan el GIL en sus kernels)
+def post_ndvi(df: pd.DataFrame) -> pd.DataFrame:
+    """NDVI: diario + suavizado."""
+    ndvi_day = (df.groupby('date', as_index=False)['NDVI'].mean()
+                .set_index('date')
+                .resample('D').mean()
+                .interpolate('time')
+                .clip(lower=0, upper=1)
+                .reset_index())
+    return suavizar_sg(ndvi_day, 'NDVI', ventana=11, poli=3)
+
+def post_lst(df: pd.DataFrame) -> pd.DataFrame:
+    """LST: Terra y Aqua promediadas por fecha (índice único para el reindex)."""
+    return df.dropna(subset=['date']).groupby('date')[['LST']].mean()
+
+def post_ppt(df: pd.DataFrame) -> pd.DataFrame:
+    """Interpolación inteligente de precipitación."""
+    all_days = pd.date_range(start=INICIO, end=FIN, freq='D')
+    ppt_full = pd.DataFrame({'date': all_days}).merge(df, on='date', how='left')
+    ppt_full['precip_mm'] = pd.to_numeric(ppt_full['precip_mm'], errors='coerce')
+
+    # Detecta rachas de ceros y reemplaza SOLO rachas cortas por NaN para interpolar
+    # (codificación por rachas en NumPy: bordes de racha -> longitudes -> repetir)
+    is_zero = ppt_full['precip_mm'].fillna(0).eq(0).to_numpy()
+    bordes = np.flatnonzero(np.r_[True, is_zero[1:] != is_zero[:-1], True])
+    largos = np.diff(bordes)
+    run_len = np.repeat(largos, largos)
+    K = 2  # máximo de días 0 seguidos a tratar como hueco (ajusta 1–3)
+    mask_short_zero = is_zero & (run_len <= K)
+    ppt_full.loc[mask_short_zero, 'precip_mm'] = np.nan
+
+    # all_days es una malla diaria uniforme: interpolar en el tiempo equivale a
+    # np.interp sobre la posición del día (los extremos toman el valor válido más
+    # cercano, como limit_direction='both')
+    y = ppt_full['precip_mm'].to_numpy()
+    dias = np.arange(y.shape[0])
+    validos = ~np.isnan(y)
+    if validos.any():
+        y_interp = np.interp(dias, dias[validos], y[validos]).astype(y.dtype)
+    else:
+        y_interp = y.copy()
+    ppt_full['precip_mm_interp'] = np.clip(y_interp, 0, None)
+
+    # Suavizado centrado 3 días
+    ppt_full['precip_mm_roll3'] = (
+        ppt_full['precip_mm_interp'].rolling(3, min_periods=1, center=True).mean()
+    )
+    return ppt_full[['date', 'precip_mm', 'precip_mm_interp', 'precip_mm_roll3']]
 
-# Precipitación (cruda + interp + roll3): merge exacto
-master = master.merge(
-    ppt_df[['date','precip_mm','precip_mm_interp','precip_mm_roll3']],
-    on='date', how='left'
-)
+def post_era(df: pd.DataFrame) -> pd.DataFrame:
+    """Humedad de suelo: unidades derivadas."""
+    return df.assign(sm_pct=df['sm_vwc'] * 100.0,
+                     water_mm_0_7cm=df['sm_vwc'] * 70.0)
 
-# Humedad de suelo ERA5-Land (diaria): merge exacto
-master = master.merge(
-    sm_df[['date','sm_vwc','sm_pct','water_mm_0_7cm']],
-    on='date', how='left'
+ndvi_day, lst_day, ppt_df, era_df = Parallel(n_jobs=4, backend='threading')(
+    delayed(f)(df) for f, df in [
+        (post_ndvi, ndvi_df), (post_lst, lst_df), (post_ppt, ppt_df), (post_era, era_df)
+    ]
 )
 
-# Tmax/Tmin aire ERA5-Land (diario): merge exacto
-master = master.merge(
-    t2m_df[['date','tmax_c','tmin_c']],
-    on='date', how='left'
+# ===================== 9) Unión por fecha =====================
+# Base: NDVI diario (con ndvisuave). Cada serie se alinea a sus fechas con
+# reindex y todas se unen con un solo concat por columnas
+fechas = pd.DatetimeIndex(ndvi_day['date'])
+
+# LST (MODIS 8-días): el más cercano ±4 días.
+# 'nearest' de reindex desempata hacia la fecha posterior y merge_asof lo hacía
+# hacia la anterior: correr el índice 1 ns conserva el desempate de antes
+UN_NS = pd.Timedelta(1, 'ns')
+lst_r = (lst_day.set_axis(lst_day.index + UN_NS)
+         .reindex(fechas, method='nearest', tolerance=pd.Timedelta('4D') + UN_NS))
+
+# Precipitación (cruda + interp + roll3): fecha exacta
+ppt_r = (ppt_df.set_index('date')[['precip_mm','precip_mm_interp','precip_mm_roll3']]
+         .reindex(fechas))
+
+# Humedad de suelo + Tmax/Tmin aire ERA5-Land (diario): fecha exacta
+era_r = (era_df.set_index('date')[['sm_vwc','sm_pct','water_mm_0_7cm','tmax_c','tmin_c']]
+         .reindex(fechas))
+
+master = pd.concat([ndvi_day.set_index('date'), lst_r, ppt_r, era_r], axis=1).reset_index()
+
+# ===================== 10) Limpieza y exporte =====================
+# LST=0 a NaN, NDVI en [0,1] y rango físico razonable, en un solo assign
+# (una columna nueva por variable en lugar de escrituras .loc sucesivas)
+lst, tmax, tmin = master['LST'], master['tmax_c'], master['tmin_c']
+master = master.assign(
+    NDVI=master['NDVI'].clip(lower=0, upper=1),
+    ndvisuave=master['ndvisuave'].clip(lower=0, upper=1),
+    LST=lst.mask(lst.fillna(0).eq(0) | lst.gt(80) | lst.lt(-50)),
+    tmax_c=tmax.mask(tmax.gt(60) | tmax.lt(-50)),
+    tmin_c=tmin.mask(tmin.gt(60) | tmin.lt(-60)),
 )
 
-# ===================== 9) Limpieza y exporte =====================
-# LST=0 a NaN, NDVI en [0,1]
-if 'LST' in master.columns:
-    master.loc[master['LST'].fillna(0).eq(0), 'LST'] = pd.NA
-for c in ['NDVI', 'ndvisuave']:
-    if c in master.columns:
-        master[c] = master[c].clip(lower=0, upper=1)
-
-# Rango físico razonable (opcional)
-master.loc[(master['LST'] > 80)   | (master['LST'] < -50),   'LST']    = pd.NA
-master.loc[(master['tmax_c'] > 60)| (master['tmax_c'] < -50),'tmax_c'] = pd.NA
-master.loc[(master['tmin_c'] > 60)| (master['tmin_c'] < -60),'tmin_c'] = pd.NA
-
 # Reordenar columnas
 cols_order = [
     'date', 'NDVI', 'ndvisuave', 'LST',
@@ -321,8 +477,17 @@ master = master.reindex(columns=cols_order)
 stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 file_name = f"datos_ndi.csv".replace(':','-')
 out_all = os.path.join(OUT_DIR, file_name)
-master.to_csv(out_all, index=False, date_format="%Y-%m-%d")
+# Escritura con Arrow (formatea números y fechas en C, sin strftime por fila);
+# date pasa a date32 para que salga como YYYY-MM-DD
+tabla = pa.Table.from_pandas(master, preserve_index=False)
+tabla = tabla.set_column(0, 'date', tabla.column('date').cast(pa.date32()))
+pacsv.write_csv(tabla, out_all, write_options=pacsv.WriteOptions(quoting_style='needed'))
 print("✅ CSV guardado:", out_all)
 
+# Copia columnar (Parquet + zstd): más compacta y rápida de releer que el CSV
+out_parquet = os.path.splitext(out_all)[0] + '.parquet'
+master.to_parquet(out_parquet, index=False, compression='zstd')
+print("✅ Parquet guardado:", out_parquet)
+
 # (Opcional) Vista rápida
 #print(master.head(10))
@@ -0,0 +1,15 @@
+"""
+TIPOS DE LAS COLUMNAS CRUDAS
+============================
+Esquema compartido por validación, ingeniería de features y entrenamiento
+"""
+
+# Tipos explícitos al leer el CSV: evita la inferencia de tipos y usa la mitad de memoria
+DTYPES = {
+    'ndvi': 'float32',
+    'evi': 'float32',
+    'lst': 'float32',
+    'tmax': 'float32',
+    'tmin': 'float32',
+    'soil_humidity': 'float32',
+}